@@ -1,19 +1,39 @@
 from pathlib import Path
-from datetime import datetime
-import sys
+import gzip
+import os
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
-from pynecore.core.ohlcv_file import OHLCVReader
-from pynecore.core.syminfo import SymInfo
 from pynecore.core.script_runner import ScriptRunner
 
+from runner_common import (
+    ScriptLibPath,
+    collect_plot_data,
+    create_price_trace,
+    create_reference_lines,
+    import_plotly,
+    load_ohlcv,
+    load_syminfo,
+    read_plot_file,
+    write_plot_parquet,
+)
+
+# Global configuration
+# Write the chart as .html.gz (much smaller on disk, but browsers only open it when served over HTTP)
+COMPRESS_HTML = False
+# Plot data format: "csv" is written by ScriptRunner, "parquet" (needs pyarrow) from the collected plot data
+PLOT_FORMAT = "csv"
+
+# Resolved once per process, these do not change between runs
+WORKDIR = Path("workdir").resolve()
+CHART_DIR = Path('visualize_html_file')
+CHART_DIR.mkdir(parents=True, exist_ok=True)
+
 def run_cwr_programmatically():
     """Run the CWR indicator programmatically using PyneCore's core components"""
     
     # Define paths (similar to CLI app_state)
-    workdir = Path("workdir").resolve()
+    workdir = WORKDIR
     scripts_dir = workdir / "scripts"
     data_dir = workdir / "data"
     output_dir = workdir / "output"
@@ -23,80 +43,73 @@ def run_cwr_programmatically():
     data_path = data_dir / "ccxt_BYBIT_BTC_USDT_USDT_1D.ohlcv"
     
     # Output paths (following CLI naming convention)
-    plot_path = output_dir / f"{script_path.stem}.csv"
+    plot_path = output_dir / f"{script_path.stem}.{PLOT_FORMAT}"
     strat_path = output_dir / f"{script_path.stem}_strat.csv"
     equity_path = output_dir / f"{script_path.stem}_equity.csv"
     
-    # Validate files exist
-    if not script_path.exists():
-        raise FileNotFoundError(f"Script file '{script_path}' not found!")
-    if not data_path.exists():
-        raise FileNotFoundError(f"Data file '{data_path}' not found!")
-    
-    # Load symbol info
+    # Validate files exist, with a single stat call per file
+    toml_path = data_path.with_suffix(".toml")
+    file_kinds = {script_path: "Script", data_path: "Data", toml_path: "Symbol info"}
     try:
-        syminfo = SymInfo.load_toml(data_path.with_suffix(".toml"))
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Symbol info file '{data_path.with_suffix('.toml')}' not found!")
-    
-    # Open data file and run script
-    with OHLCVReader(data_path) as reader:
-        # Use full time range from data
-        time_from = reader.start_datetime.replace(tzinfo=None)
-        time_to = reader.end_datetime.replace(tzinfo=None)
+        file_stats = {path: os.stat(path) for path in file_kinds}
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"{file_kinds[Path(e.filename)]} file '{e.filename}' not found!") from None
+    
+    # Load symbol info (the TOML is only parsed again if it has changed)
+    syminfo = load_syminfo(os.fspath(toml_path), file_stats[toml_path].st_mtime_ns)
+    
+    # Use full time range from data, the data file is only read again if it has changed
+    time_from, time_to, size, candles = load_ohlcv(os.fspath(data_path), file_stats[data_path].st_mtime_ns)
+    
+    # Make the lib directory importable for library imports (like CLI does), without touching sys.path
+    with ScriptLibPath(scripts_dir / "lib"):
+        # Create and run script runner
+        runner = ScriptRunner(
+            script_path, 
+            candles, 
+            syminfo, 
+            last_bar_index=size - 1,
+            plot_path=plot_path if PLOT_FORMAT == "csv" else None, 
+            strat_path=strat_path, 
+            equity_path=equity_path
+        )
+        
+        print(f"Running script: {script_path.name}")
+        print(f"Data: {data_path.name}")
+        print(f"Time range: {time_from} to {time_to}")
         
-        # Get data iterator and size
-        size = reader.get_size(int(time_from.timestamp()), int(time_to.timestamp()))
-        ohlcv_iter = reader.read_from(int(time_from.timestamp()), int(time_to.timestamp()))
+        # Run the script, keeping the plotted values for the visualization
+        plot_df = collect_plot_data(runner, size)
+        if PLOT_FORMAT == "parquet":
+            write_plot_parquet(plot_df, plot_path)
         
-        # Add lib directory to Python path for library imports (like CLI does)
-        lib_dir = scripts_dir / "lib"
-        lib_path_added = False
-        if lib_dir.exists() and lib_dir.is_dir():
-            sys.path.insert(0, str(lib_dir))
-            lib_path_added = True
+        print("\nPyneCore script executed successfully!")
+        print(f"Results saved to:")
+        print(f"  Plot data: {plot_path}")
         
-        try:
-            # Create and run script runner
-            runner = ScriptRunner(
-                script_path, 
-                ohlcv_iter, 
-                syminfo, 
-                last_bar_index=size - 1,
-                plot_path=plot_path, 
-                strat_path=strat_path, 
-                equity_path=equity_path
-            )
-            
-            print(f"Running script: {script_path.name}")
-            print(f"Data: {data_path.name}")
-            print(f"Time range: {time_from} to {time_to}")
-            
-            # Run the script
-            runner.run()
-            
-            print("\nPyneCore script executed successfully!")
-            print(f"Results saved to:")
-            print(f"  Plot data: {plot_path}")
-            
-            # Generate visualization
-            chart_path = create_cwr_visualization(plot_path, output_dir)
-            print(f"  Visualization: {chart_path}")
-            
-        finally:
-            # Remove lib directory from Python path
-            if lib_path_added:
-                sys.path.remove(str(lib_dir))
+        # Generate visualization
+        chart_path = create_cwr_visualization(plot_path, output_dir, plot_df)
+        print(f"  Visualization: {chart_path}")
 
-def create_cwr_visualization(csv_path: Path, output_dir: Path) -> Path:
+def create_cwr_visualization(csv_path: Path, output_dir: Path, df: pd.DataFrame | None = None) -> Path:
     """Create an interactive visualization of price data with CWR overlay"""
     
-    # Read the CSV data
-    df = pd.read_csv(csv_path)
-    df['time'] = pd.to_datetime(df['time'])
+    go, make_subplots, FigureResampler = import_plotly()
+    
+    # Read the CSV data, unless the plotted values were passed in by the runner
+    if df is None:
+        df = read_plot_file(csv_path)
     
-    # Filter out rows where CWR is NaN (initial period before SMA calculation)
-    df_with_cwr = df.dropna(subset=['cwr'])
+    # Extract the candle columns as NumPy arrays, plotly encodes those directly instead of iterating pandas Series
+    times = df['time'].values
+    opens = df['open'].values
+    highs = df['high'].values
+    lows = df['low'].values
+    closes = df['close'].values
+    
+    # Filter out rows where CWR is NaN (initial period before SMA calculation), with a mask instead of a copied DataFrame
+    cwrs = df['cwr'].values
+    cwr_mask = ~np.isnan(cwrs)
     
     # Create subplots: price chart on top, CWR indicator below
     fig = make_subplots(
@@ -107,26 +120,18 @@ def create_cwr_visualization(csv_path: Path, output_dir: Path) -> Path:
         row_heights=[0.7, 0.3]
     )
     
-    # Add candlestick chart
-    fig.add_trace(
-        go.Candlestick(
-            x=df['time'],
-            open=df['open'],
-            high=df['high'],
-            low=df['low'],
-            close=df['close'],
-            name='BTC/USDT',
-            increasing_line_color='#00ff88',
-            decreasing_line_color='#ff4444'
-        ),
-        row=1, col=1
-    )
+    # Add candlestick chart, before the resampler takes over the figure so the price trace is kept as it is
+    fig.add_trace(create_price_trace(times, opens, highs, lows, closes), row=1, col=1)
+    
+    # Keep the full series on the backend and serialize only an LTTB-downsampled view of the line traces
+    if FigureResampler is not None:
+        fig = FigureResampler(fig, default_n_shown_samples=2000, convert_existing_traces=False)
     
     # Add CWR line chart
     fig.add_trace(
-        go.Scatter(
-            x=df_with_cwr['time'],
-            y=df_with_cwr['cwr'],
+        go.Scattergl(
+            x=times[cwr_mask],
+            y=cwrs[cwr_mask],
             mode='lines',
             name='CWR',
             line=dict(color='#2E86AB', width=2)
@@ -134,13 +139,9 @@ def create_cwr_visualization(csv_path: Path, output_dir: Path) -> Path:
         row=2, col=1
     )
     
-    # Add horizontal reference lines for CWR
-    fig.add_hline(y=1.0, line_dash="dash", line_color="gray", 
-                  annotation_text="Baseline (1.0)", row=2, col=1)
-    fig.add_hline(y=1.5, line_dash="dot", line_color="red", 
-                  annotation_text="High Volatility (1.5)", row=2, col=1)
-    fig.add_hline(y=0.5, line_dash="dot", line_color="green", 
-                  annotation_text="Low Volatility (0.5)", row=2, col=1)
+    # Add horizontal reference lines for CWR, with a single layout update instead of one per add_hline
+    shapes, annotations = create_reference_lines(row=2)
+    fig.update_layout(shapes=shapes, annotations=[*fig.layout.annotations, *annotations])
     
     # Update layout
     fig.update_layout(
@@ -163,10 +164,15 @@ def create_cwr_visualization(csv_path: Path, output_dir: Path) -> Path:
     fig.update_xaxes(rangeslider_visible=False)
     
     # Save the chart
-    chart_path = Path('visualize_html_file') / 'cwr_visualization.html'
-    # Create directory if it doesn't exist
-    Path('visualize_html_file').mkdir(parents=True, exist_ok=True)
-    fig.write_html(str(chart_path))
+    chart_path = CHART_DIR / 'cwr_visualization.html'
+    # Load plotly.js from the CDN instead of inlining the bundle, and skip re-validating the traces on export
+    if COMPRESS_HTML:
+        # Gzipped page for batch runs, to be served with Content-Encoding: gzip
+        chart_path = chart_path.with_suffix('.html.gz')
+        with gzip.open(chart_path, 'wt', encoding='utf-8') as f:
+            f.write(fig.to_html(include_plotlyjs='cdn', full_html=True, validate=False))
+    else:
+        fig.write_html(chart_path, include_plotlyjs='cdn', full_html=True, validate=False, auto_open=False)
     
     return chart_path
 
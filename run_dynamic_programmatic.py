@@ -1,24 +1,58 @@
 from pathlib import Path
-from datetime import datetime
-import sys
+import gzip
+import os
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
-from pynecore.core.ohlcv_file import OHLCVReader
-from pynecore.core.syminfo import SymInfo
 from pynecore.core.script_runner import ScriptRunner
 
+from runner_common import (
+    ScriptLibPath,
+    collect_plot_data,
+    create_price_trace,
+    create_reference_lines,
+    import_plotly,
+    load_ohlcv,
+    load_syminfo,
+    read_plot_file,
+    write_plot_parquet,
+)
+
 # Global configuration
 FILE_NAME = "p2"
 CHART_FILENAME = f"{FILE_NAME}_visualization.html"
 SCRIPT_NAME = f"{FILE_NAME}.py"
+# Write the chart as .html.gz (much smaller on disk, but browsers only open it when served over HTTP)
+COMPRESS_HTML = False
+# Plot data format: "csv" is written by ScriptRunner, "parquet" (needs pyarrow) from the collected plot data
+PLOT_FORMAT = "csv"
+# With more traces than this, hovering shows the closest point instead of a unified label of every trace
+UNIFIED_HOVER_MAX_TRACES = 8
+# Styling shared by every chart, built once instead of on each visualization call
+INDICATOR_COLORS = ('#2E86AB', '#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7')
+LAYOUT_BASE = {
+    'title': {
+        'x': 0.5,
+        'xanchor': 'center',
+        'font': {'size': 16}
+    },
+    'xaxis_title': 'Date',
+    'yaxis_title': 'Price (USDT)',
+    'height': 800,
+    'showlegend': True,
+    'template': 'plotly_white'
+}
+
+# Resolved once per process, these do not change between runs
+WORKDIR = Path("workdir").resolve()
+CHART_DIR = Path('visualize_html_file')
+CHART_DIR.mkdir(parents=True, exist_ok=True)
 
 def run_cwr_programmatically():
     """Run the CWR indicator programmatically using PyneCore's core components"""
     
     # Define paths (similar to CLI app_state)
-    workdir = Path("workdir").resolve()
+    workdir = WORKDIR
     scripts_dir = workdir / "scripts"
     data_dir = workdir / "data"
     output_dir = workdir / "output"
@@ -28,77 +62,62 @@ def run_cwr_programmatically():
     data_path = data_dir / "ccxt_BYBIT_BTC_USDT_USDT_1D.ohlcv"
     
     # Output paths (following CLI naming convention)
-    plot_path = output_dir / f"{script_path.stem}.csv"
+    plot_path = output_dir / f"{script_path.stem}.{PLOT_FORMAT}"
     strat_path = output_dir / f"{script_path.stem}_strat.csv"
     equity_path = output_dir / f"{script_path.stem}_equity.csv"
     
-    # Validate files exist
-    if not script_path.exists():
-        raise FileNotFoundError(f"Script file '{script_path}' not found!")
-    if not data_path.exists():
-        raise FileNotFoundError(f"Data file '{data_path}' not found!")
-    
-    # Load symbol info
+    # Validate files exist, with a single stat call per file
+    toml_path = data_path.with_suffix(".toml")
+    file_kinds = {script_path: "Script", data_path: "Data", toml_path: "Symbol info"}
     try:
-        syminfo = SymInfo.load_toml(data_path.with_suffix(".toml"))
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Symbol info file '{data_path.with_suffix('.toml')}' not found!")
+        file_stats = {path: os.stat(path) for path in file_kinds}
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"{file_kinds[Path(e.filename)]} file '{e.filename}' not found!") from None
     
-    # Open data file and run script
-    with OHLCVReader(data_path) as reader:
-        # Use full time range from data
-        time_from = reader.start_datetime.replace(tzinfo=None)
-        time_to = reader.end_datetime.replace(tzinfo=None)
+    # Load symbol info (the TOML is only parsed again if it has changed)
+    syminfo = load_syminfo(os.fspath(toml_path), file_stats[toml_path].st_mtime_ns)
+    
+    # Use full time range from data, the data file is only read again if it has changed
+    time_from, time_to, size, candles = load_ohlcv(os.fspath(data_path), file_stats[data_path].st_mtime_ns)
+    
+    # Make the lib directory importable for library imports (like CLI does), without touching sys.path
+    with ScriptLibPath(scripts_dir / "lib"):
+        # Create and run script runner
+        runner = ScriptRunner(
+            script_path, 
+            candles, 
+            syminfo, 
+            last_bar_index=size - 1,
+            plot_path=plot_path if PLOT_FORMAT == "csv" else None, 
+            strat_path=strat_path, 
+            equity_path=equity_path
+        )
         
-        # Get data iterator and size
-        size = reader.get_size(int(time_from.timestamp()), int(time_to.timestamp()))
-        ohlcv_iter = reader.read_from(int(time_from.timestamp()), int(time_to.timestamp()))
+        print(f"Running script: {script_path.name}")
+        print(f"Data: {data_path.name}")
+        print(f"Time range: {time_from} to {time_to}")
         
-        # Add lib directory to Python path for library imports (like CLI does)
-        lib_dir = scripts_dir / "lib"
-        lib_path_added = False
-        if lib_dir.exists() and lib_dir.is_dir():
-            sys.path.insert(0, str(lib_dir))
-            lib_path_added = True
+        # Run the script, keeping the plotted values for the visualization
+        plot_df = collect_plot_data(runner, size)
+        if PLOT_FORMAT == "parquet":
+            write_plot_parquet(plot_df, plot_path)
         
-        try:
-            # Create and run script runner
-            runner = ScriptRunner(
-                script_path, 
-                ohlcv_iter, 
-                syminfo, 
-                last_bar_index=size - 1,
-                plot_path=plot_path, 
-                strat_path=strat_path, 
-                equity_path=equity_path
-            )
-            
-            print(f"Running script: {script_path.name}")
-            print(f"Data: {data_path.name}")
-            print(f"Time range: {time_from} to {time_to}")
-            
-            # Run the script
-            runner.run()
-            
-            print("\nPyneCore script executed successfully!")
-            print(f"Results saved to:")
-            print(f"  Plot data: {plot_path}")
-            
-            # Generate visualization
-            chart_path = create_dynamic_visualization(plot_path, output_dir)
-            print(f"  Visualization: {chart_path}")
-            
-        finally:
-            # Remove lib directory from Python path
-            if lib_path_added:
-                sys.path.remove(str(lib_dir))
+        print("\nPyneCore script executed successfully!")
+        print(f"Results saved to:")
+        print(f"  Plot data: {plot_path}")
+        
+        # Generate visualization
+        chart_path = create_dynamic_visualization(plot_path, output_dir, plot_df)
+        print(f"  Visualization: {chart_path}")
 
-def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
+def create_dynamic_visualization(csv_path: Path, output_dir: Path, df: pd.DataFrame | None = None) -> Path:
     """Create an interactive visualization of price data with dynamic indicator overlay"""
     
-    # Read the CSV data
-    df = pd.read_csv(csv_path)
-    df['time'] = pd.to_datetime(df['time'])
+    go, make_subplots, FigureResampler = import_plotly()
+    
+    # Read the CSV data, unless the plotted values were passed in by the runner
+    if df is None:
+        df = read_plot_file(csv_path)
     
     # Identify OHLCV columns
     ohlcv_cols = ['open', 'high', 'low', 'close', 'volume']
@@ -107,28 +126,29 @@ def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
     indicator_cols = [col for col in df.columns if col not in ohlcv_cols + ['time']]
     
     # Detect signal columns (typically binary 0/1 values for buy/sell signals)
-    signal_cols = []
-    line_indicator_cols = []
+    # Analyze all indicator columns at once: sorting each column puts NaNs last and equal values next to each other,
+    # so distinct non-NaN values can be counted from the changes between neighbours
+    values = np.sort(df[indicator_cols].to_numpy(dtype=np.float64), axis=0)
+    is_valid = ~np.isnan(values)
+    n_valid = is_valid.sum(axis=0)
+    n_unique = ((np.diff(values, axis=0) != 0) & is_valid[1:]).sum(axis=0) + (n_valid > 0)
+    col_max = np.max(values, axis=0, initial=-np.inf, where=is_valid)
     
-    # Analyze indicator columns to separate signals from continuous indicators
-    for col in indicator_cols:
-        # Check if column contains mostly NaN/0 values with occasional 1s (typical for signals)
-        non_na_values = df[col].dropna()
-        if len(non_na_values) > 0:
-            unique_vals = non_na_values.unique()
-            # If column has binary values or very few unique values, treat as signal
-            if set(unique_vals).issubset({0, 1}) or (len(unique_vals) <= 3 and non_na_values.max() <= 1):
-                signal_cols.append(col)
-            else:
-                line_indicator_cols.append(col)
-        else:
-            line_indicator_cols.append(col)
+    # Columns with very few unique values, none above 1, are treated as signals
+    is_signal = (n_valid > 0) & (n_unique <= 3) & (col_max <= 1)
+    signal_cols = [col for col, signal in zip(indicator_cols, is_signal) if signal]
+    line_indicator_cols = [col for col, signal in zip(indicator_cols, is_signal) if not signal]
     
-    # Filter out rows with NaN values in indicator columns for line charts
-    if line_indicator_cols:
-        df_with_indicators = df.dropna(subset=line_indicator_cols)
-    else:
-        df_with_indicators = df
+    # Filter out rows with NaN values in indicator columns for line charts, using a single NaN scan over
+    # the indicator values instead of copying the DataFrame
+    indicator_mask = ~np.isnan(df[line_indicator_cols].to_numpy(dtype=np.float64)).any(axis=1)
+    
+    # Extract the candle columns as NumPy arrays, plotly encodes those directly instead of iterating pandas Series
+    times = df['time'].values
+    opens = df['open'].values
+    highs = df['high'].values
+    lows = df['low'].values
+    closes = df['close'].values
     
     # Determine if we need subplots based on available indicators
     if line_indicator_cols:
@@ -147,43 +167,39 @@ def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
         )
         indicator_row = 1
     
-    # Add candlestick chart
-    fig.add_trace(
-        go.Candlestick(
-            x=df['time'],
-            open=df['open'],
-            high=df['high'],
-            low=df['low'],
-            close=df['close'],
-            name='BTC/USDT',
-            increasing_line_color='#00ff88',
-            decreasing_line_color='#ff4444'
-        ),
-        row=1, col=1
-    )
+    # Add candlestick chart, before the resampler takes over the figure so the price trace is kept as it is
+    fig.add_trace(create_price_trace(times, opens, highs, lows, closes), row=1, col=1)
+    
+    # Keep the full series on the backend and serialize only an LTTB-downsampled view of the line traces
+    if FigureResampler is not None:
+        fig = FigureResampler(fig, default_n_shown_samples=2000, convert_existing_traces=False)
     
-    # Add indicator lines if available
+    # Add indicator lines if available, in one batch so the figure is validated once instead of per trace
     if line_indicator_cols:
-        colors = ['#2E86AB', '#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7']
-        for i, col in enumerate(line_indicator_cols):
-            color = colors[i % len(colors)]
-            fig.add_trace(
-                go.Scatter(
-                    x=df_with_indicators['time'],
-                    y=df_with_indicators[col],
-                    mode='lines',
-                    name=col,
-                    line=dict(color=color, width=2)
-                ),
-                row=indicator_row, col=1
+        indicator_time = times[indicator_mask]
+        indicator_traces = [
+            go.Scattergl(
+                x=indicator_time,
+                y=df[col].to_numpy()[indicator_mask],
+                mode='lines',
+                name=col,
+                line=dict(color=INDICATOR_COLORS[i % len(INDICATOR_COLORS)], width=2)
             )
+            for i, col in enumerate(line_indicator_cols)
+        ]
+        fig.add_traces(
+            indicator_traces,
+            rows=[indicator_row] * len(indicator_traces), cols=[1] * len(indicator_traces)
+        )
     
     # Add buy/sell signals if detected
+    signal_traces = []
     for col in signal_cols:
-        # Get non-NaN signal points
-        signal_df = df[df[col].notna() & (df[col] != 0)]
+        # Get non-NaN signal points as a mask over the NumPy arrays, without copying the DataFrame
+        signal_values = df[col].to_numpy(dtype=np.float64)
+        signal_mask = ~np.isnan(signal_values) & (signal_values != 0)
         
-        if not signal_df.empty:
+        if signal_mask.any():
             # Determine if this is likely a buy or sell signal based on column name
             is_buy_signal = any(term in col.lower() for term in ['buy', 'long', 'up'])
             is_sell_signal = any(term in col.lower() for term in ['sell', 'short', 'down'])
@@ -199,19 +215,19 @@ def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
                 marker_size = 10
                 signal_name = f"Buy Signal ({col})"
                 # Position below candle
-                y_values = signal_df['low'] * 0.995  # Slightly below the low price
+                y_values = lows[signal_mask] * 0.995  # Slightly below the low price
             else:  # sell signal
                 marker_color = 'red'
                 marker_symbol = 'triangle-down'
                 marker_size = 10
                 signal_name = f"Sell Signal ({col})"
                 # Position above candle
-                y_values = signal_df['high'] * 1.005  # Slightly above the high price
+                y_values = highs[signal_mask] * 1.005  # Slightly above the high price
             
-            # Add the signal markers
-            fig.add_trace(
-                go.Scatter(
-                    x=signal_df['time'],
+            # Collect the signal markers, they are added to the price chart together
+            signal_traces.append(
+                go.Scattergl(
+                    x=times[signal_mask],
                     y=y_values,
                     mode='markers',
                     name=signal_name,
@@ -220,18 +236,17 @@ def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
                         size=marker_size,
                         symbol=marker_symbol
                     )
-                ),
-                row=1, col=1
+                )
             )
     
+    if signal_traces:
+        fig.add_traces(signal_traces, rows=[1] * len(signal_traces), cols=[1] * len(signal_traces))
+    
     # Add reference lines for specific indicators
     if 'cwr' in line_indicator_cols:
-        fig.add_hline(y=1.0, line_dash="dash", line_color="gray", 
-                      annotation_text="Baseline (1.0)", row=indicator_row, col=1)
-        fig.add_hline(y=1.5, line_dash="dot", line_color="red", 
-                      annotation_text="High Volatility (1.5)", row=indicator_row, col=1)
-        fig.add_hline(y=0.5, line_dash="dot", line_color="green", 
-                      annotation_text="Low Volatility (0.5)", row=indicator_row, col=1)
+        # With a single layout update instead of one per add_hline
+        shapes, annotations = create_reference_lines(row=indicator_row)
+        fig.update_layout(shapes=shapes, annotations=[*fig.layout.annotations, *annotations])
     
     # Determine chart title based on indicators and script name
     script_name = csv_path.stem
@@ -252,33 +267,28 @@ def create_dynamic_visualization(csv_path: Path, output_dir: Path) -> Path:
     
     # Update layout
     layout_config = {
-        'title': {
-            'text': chart_title,
-            'x': 0.5,
-            'xanchor': 'center',
-            'font': {'size': 16}
-        },
-        'xaxis_title': 'Date',
-        'yaxis_title': 'Price (USDT)',
-        'height': 800,
-        'showlegend': True,
-        'hovermode': 'x unified',
-        'template': 'plotly_white'
+        'title_text': chart_title,
+        'hovermode': 'x unified' if len(fig.data) <= UNIFIED_HOVER_MAX_TRACES else 'closest'
     }
     
     if line_indicator_cols:
         layout_config['yaxis2_title'] = indicator_title
     
-    fig.update_layout(**layout_config)
+    fig.update_layout(LAYOUT_BASE, **layout_config)
     
     # Update x-axis formatting
     fig.update_xaxes(rangeslider_visible=False)
     
     # Save the chart
-    chart_path = Path('visualize_html_file') / CHART_FILENAME
-    # Create directory if it doesn't exist
-    Path('visualize_html_file').mkdir(parents=True, exist_ok=True)
-    fig.write_html(str(chart_path))
+    chart_path = CHART_DIR / CHART_FILENAME
+    # Load plotly.js from the CDN instead of inlining the bundle, and skip re-validating the traces on export
+    if COMPRESS_HTML:
+        # Gzipped page for batch runs, to be served with Content-Encoding: gzip
+        chart_path = chart_path.with_suffix('.html.gz')
+        with gzip.open(chart_path, 'wt', encoding='utf-8') as f:
+            f.write(fig.to_html(include_plotlyjs='cdn', full_html=True, validate=False))
+    else:
+        fig.write_html(chart_path, include_plotlyjs='cdn', full_html=True, validate=False, auto_open=False)
     
     return chart_path
 
@@ -0,0 +1,225 @@
+"""Helpers shared by the programmatic runner scripts"""
+from pathlib import Path
+from datetime import datetime
+from typing import Iterator
+import functools
+import importlib.abc
+import sys
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:  # pyarrow is optional, pandas' CSV parser is used without it
+    pa = None
+
+from pynecore.core.ohlcv_file import OHLCVReader
+from pynecore.core.syminfo import SymInfo
+from pynecore.core.script_runner import ScriptRunner
+from pynecore.types.ohlcv import OHLCV
+from pynecore.types.na import NA
+
+# Above this many bars the price chart aggregates consecutive bars into this many candles
+CANDLESTICK_MAX_BARS = 2000
+CANDLE_INCREASING_COLOR = '#00ff88'
+CANDLE_DECREASING_COLOR = '#ff4444'
+# Reference levels of the CWR indicator: value, line dash, line color and label
+CWR_REFERENCE_LINES = (
+    (1.0, 'dash', 'gray', 'Baseline (1.0)'),
+    (1.5, 'dot', 'red', 'High Volatility (1.5)'),
+    (0.5, 'dot', 'green', 'Low Volatility (0.5)'),
+)
+
+class ScriptLibPath(importlib.abc.MetaPathFinder):
+    """Make modules in the scripts' lib directory importable while active, without modifying sys.path"""
+    
+    def __init__(self, lib_dir: Path):
+        self.search_path = [str(lib_dir)] if lib_dir.is_dir() else []
+    
+    def find_spec(self, fullname, path, target=None):
+        # Submodules are found through their package's __path__, only top level imports are resolved here
+        if path is not None or not self.search_path:
+            return None
+        # Resolve with PyneCore's import hook, so Pyne libraries get the same AST transformation as scripts
+        from pynecore.core.import_hook import PyneImportHook
+        return PyneImportHook().find_spec(fullname, self.search_path, target)
+    
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        sys.meta_path.remove(self)
+
+@functools.lru_cache(maxsize=32)
+def load_syminfo(toml_path: str, mtime_ns: int) -> SymInfo:
+    """Load symbol info from TOML, cached per file and modification time so edits invalidate the cache"""
+    return SymInfo.load_toml(Path(toml_path))
+
+def open_range(reader: OHLCVReader, time_from: datetime, time_to: datetime) -> tuple[int, Iterator[OHLCV]]:
+    """Seek the OHLCV file once, return the number of bars in the range and an iterator over the mapped records"""
+    
+    start_pos, end_pos = reader.get_positions(int(time_from.timestamp()), int(time_to.timestamp()))
+    # Gaps are filled with -1 volume by the writer, skip them like OHLCVReader.read_from does
+    ohlcv_iter = (candle for candle in map(reader.read, range(start_pos, end_pos)) if candle.volume >= 0)
+    return end_pos - start_pos, ohlcv_iter
+
+@functools.lru_cache(maxsize=1)
+def load_ohlcv(data_path: str, mtime_ns: int) -> tuple[datetime, datetime, int, tuple[OHLCV, ...]]:
+    """Read the full time range and its bars once, cached per file and modification time for repeated runs"""
+    
+    with OHLCVReader(data_path) as reader:
+        time_from = reader.start_datetime.replace(tzinfo=None)
+        time_to = reader.end_datetime.replace(tzinfo=None)
+        size, ohlcv_iter = open_range(reader, time_from, time_to)
+        return time_from, time_to, size, tuple(ohlcv_iter)
+
+def collect_plot_data(runner: ScriptRunner, size: int) -> pd.DataFrame:
+    """Run the script and collect the plotted values in memory, alongside the plot CSV if the runner writes one"""
+    
+    # One preallocated array per column instead of a dict per bar, size is an upper bound as gaps are skipped
+    columns = {'time': np.empty(size, dtype=np.int64)}
+    columns.update((key, np.empty(size, dtype=np.float64)) for key in ('open', 'high', 'low', 'close', 'volume'))
+    skipped = set()
+    count = 0
+    for count, (candle, plot_data, *_) in enumerate(runner.run_iter(), 1):
+        i = count - 1
+        columns['time'][i] = candle.timestamp
+        columns['open'][i] = candle.open
+        columns['high'][i] = candle.high
+        columns['low'][i] = candle.low
+        columns['close'][i] = candle.close
+        columns['volume'][i] = candle.volume
+        
+        # The runner clears its plot dict after every bar, so the values are copied out here
+        for key, value in plot_data.items():
+            if key in skipped:
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = np.full(size, np.nan)
+            try:
+                column[i] = np.nan if isinstance(value, NA) else value
+            except (TypeError, ValueError):
+                # Only numbers fit the float columns, and only numeric series are charted
+                print(f"Plot value '{key}' is not a number ({value!r}), it is left out of the collected plot data")
+                del columns[key]
+                skipped.add(key)
+    
+    df = pd.DataFrame({key: column[:count] for key, column in columns.items()})
+    df['time'] = pd.to_datetime(df['time'], unit='s', utc=True)
+    return df
+
+def read_plot_csv(csv_path: Path) -> pd.DataFrame:
+    """Read a plot CSV written by ScriptRunner, parsed by pyarrow's multithreaded reader if available"""
+    
+    if pa is None:
+        # Known column types and one timestamp format skip pandas' type and date format inference
+        return pd.read_csv(
+            csv_path,
+            dtype={col: 'float64' for col in ('open', 'high', 'low', 'close', 'volume')},
+            parse_dates=['time'],
+            date_format='ISO8601'
+        )
+    
+    # OHLCV columns have a fixed schema, timestamps are parsed inline by Arrow with or without a zone offset
+    convert_options = pa_csv.ConvertOptions(
+        column_types={col: pa.float64() for col in ('open', 'high', 'low', 'close', 'volume')},
+        timestamp_parsers=[pa_csv.ISO8601, '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']
+    )
+    table = pa_csv.read_csv(csv_path, convert_options=convert_options)
+    
+    # Plot columns without any value are inferred as null type, keep them as float NaN like pandas does,
+    # and date-only times are inferred as dates, make them timestamps like pandas does
+    table = table.cast(pa.schema([
+        field.with_type(pa.float64()) if pa.types.is_null(field.type)
+        else field.with_type(pa.timestamp('s')) if pa.types.is_date(field.type)
+        else field
+        for field in table.schema
+    ]))
+    
+    return table.to_pandas(self_destruct=True)
+
+@functools.lru_cache(maxsize=None)
+def import_plotly():
+    """Import plotly on first use, it is only needed once a chart is created"""
+    
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    try:
+        from plotly_resampler import FigureResampler
+    except ImportError:  # plotly-resampler is optional, every point is exported without it
+        FigureResampler = None
+    return go, make_subplots, FigureResampler
+
+def write_plot_parquet(df: pd.DataFrame, parquet_path: Path):
+    """Write the collected plot data as a zstd compressed Parquet file"""
+    
+    if pa is None:
+        raise ImportError("Writing plot data as Parquet requires pyarrow!")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pa_parquet.write_table(table, parquet_path, compression='zstd', compression_level=3)
+
+def read_plot_file(plot_path: Path) -> pd.DataFrame:
+    """Read plot data from a Parquet file or a plot CSV, based on the file extension"""
+    
+    if plot_path.suffix == '.parquet':
+        if pa is None:
+            raise ImportError("Reading plot data from Parquet requires pyarrow!")
+        # Parquet keeps the column types, so the time column needs no parsing
+        return pa_parquet.read_table(plot_path).to_pandas(self_destruct=True)
+    return read_plot_csv(plot_path)
+
+def aggregate_ohlc(times: np.ndarray, opens: np.ndarray, highs: np.ndarray, lows: np.ndarray,
+                   closes: np.ndarray, max_bars: int) -> tuple[np.ndarray, ...]:
+    """Aggregate at least max_bars consecutive bars into exactly max_bars buckets, each shown at its first bar's time"""
+    
+    # Evenly spread bucket boundaries, bucket sizes differ by at most one bar
+    starts = np.arange(max_bars) * len(times) // max_bars
+    ends = np.append(starts[1:], len(times))
+    return (
+        times[starts],
+        opens[starts],
+        np.maximum.reduceat(highs, starts),
+        np.minimum.reduceat(lows, starts),
+        closes[ends - 1],
+    )
+
+def create_price_trace(times: np.ndarray, opens: np.ndarray, highs: np.ndarray, lows: np.ndarray,
+                       closes: np.ndarray):
+    """Create the candlestick price trace, long series are aggregated to CANDLESTICK_MAX_BARS candles"""
+    
+    go, _, _ = import_plotly()
+    
+    # The browser can't show more candles than the chart is wide, and an SVG candlestick gets slow with many bars
+    if len(times) > CANDLESTICK_MAX_BARS:
+        times, opens, highs, lows, closes = aggregate_ohlc(times, opens, highs, lows, closes, CANDLESTICK_MAX_BARS)
+    
+    return go.Candlestick(
+        x=times,
+        open=opens,
+        high=highs,
+        low=lows,
+        close=closes,
+        name='BTC/USDT',
+        increasing_line_color=CANDLE_INCREASING_COLOR,
+        decreasing_line_color=CANDLE_DECREASING_COLOR
+    )
+
+def create_reference_lines(row: int) -> tuple[list[dict], list[dict]]:
+    """Create the CWR reference levels of a subplot row as layout shapes and their annotations"""
+    
+    axis = '' if row == 1 else str(row)
+    shapes = [
+        dict(type='line', xref=f'x{axis} domain', x0=0, x1=1, yref=f'y{axis}', y0=level, y1=level,
+             line=dict(dash=dash, color=color))
+        for level, dash, color, _ in CWR_REFERENCE_LINES
+    ]
+    annotations = [
+        dict(text=text, showarrow=False, xref=f'x{axis} domain', x=1, xanchor='right',
+             yref=f'y{axis}', y=level, yanchor='bottom')
+        for level, _, _, text in CWR_REFERENCE_LINES
+    ]
+    return shapes, annotations